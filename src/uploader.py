@@ -2,24 +2,70 @@
 
 from __future__ import annotations
 
+import collections
 import functools
 import hashlib
+import json
 import logging
 import pathlib
+import queue
+import random
 import re
+import threading
 import time
-from dataclasses import dataclass
+import tomllib
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import Any, Iterator
+from typing import Any, Iterator, Sequence
 
 import requests
-import yaml
 
-logger = logging.getLogger(__name__)
+try:
+    from orjson import dumps as _json_dumps  # optional, speeds up batched uploads
+except ImportError:
+
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
 
 
-@dataclass
+logger = logging.getLogger(__name__)
+
+# uid-serial-sensorId-sequence, as found in EasyView download records
+_RECORD_RE = re.compile(r"(\d+)-(\d+)-(\d+)-(\d+)")
+
+# Nightscout direction per glucose rate; both 0 and 8 show as Flat in the app
+_DIRECTIONS = (
+    "Flat",
+    "FortyFiveUp",
+    "SingleUp",
+    "DoubleUp",
+    "FortyFiveDown",
+    "SingleDown",
+    "DoubleDown",
+    None,
+    "Flat",
+)
+
+_unknown_rates: set[int] = set()
+
+
+def _sgv_entry(
+    device_type: str, unix_timestamp: int, glucose: float, direction: str | None
+) -> dict[str, str | int]:
+    """Build a Nightscout sgv entry dictionary."""
+    t = time.gmtime(unix_timestamp)
+    return {
+        "type": "sgv",
+        "date": unix_timestamp * 1000,
+        "dateString": "%04d-%02d-%02dT%02d:%02d:%02d+00:00" % t[:6],
+        "sgv": int(glucose * 18 + 0.5),
+        "direction": direction or "NONE",
+        "device": device_type,
+    }
+
+
+@dataclass(slots=True)
 class SensorStatus:
     """Dataclass representing a Medtrum sensor status."""
 
@@ -34,6 +80,17 @@ class SensorStatus:
     app_name: str | None = None
     battery_percent: float | None = None
     current: int | None = None
+    _nightscout_entry: dict[str, str | int] | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _key: tuple[int, int] = field(init=False, repr=False, compare=False)
+    _preceding_key: tuple[int, int] = field(init=False, repr=False, compare=False)
+    _unix_timestamp: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self._key = (self.sensor_id, self.sequence)
+        self._preceding_key = (self.sensor_id, self.sequence - 1)
+        self._unix_timestamp = round(self.update_time)
 
     class Status(Enum):
         """Medtrum Status"""
@@ -45,7 +102,7 @@ class SensorStatus:
     @property
     def unix_timestamp(self) -> int:
         """Return the timestamp as an integer."""
-        return round(self.update_time)
+        return self._unix_timestamp
 
     @property
     def timestamp(self) -> datetime:
@@ -55,45 +112,37 @@ class SensorStatus:
     @property
     def key(self) -> tuple[int, int]:
         """Return unique key for the entry."""
-        return (self.sensor_id, self.sequence)
+        return self._key
 
     @property
     def preceding_key(self) -> tuple[int, int]:
         """Return preceding key for the entry."""
-        return (self.sensor_id, self.sequence - 1)
+        return self._preceding_key
 
     @property
     def direction(self) -> str | None:
         """Return direction of glucose change."""
-        directions = {
-            0: "Flat",
-            1: "FortyFiveUp",
-            2: "SingleUp",
-            3: "DoubleUp",
-            4: "FortyFiveDown",
-            5: "SingleDown",
-            6: "DoubleDown",
-            8: "Flat",  # both 0 and 8 seem to show as Flat in the app
-        }
-        if self.glucose_rate not in directions:
+        if 0 <= self.glucose_rate < len(_DIRECTIONS):
+            direction = _DIRECTIONS[self.glucose_rate]
+        else:
+            direction = None
+        if direction is None and self.glucose_rate not in _unknown_rates:
+            _unknown_rates.add(self.glucose_rate)
             logger.warning(
                 "unknown glucose rate %i on entry %i",
                 self.glucose_rate,
                 self.sequence,
             )
-        return directions.get(self.glucose_rate)
+        return direction
 
     @property
     def nightscout_entry(self) -> dict[str, str | int]:
-        """Return sensor status as Nightscout entry."""
-        return {
-            "type": "sgv",
-            "date": self.unix_timestamp * 1000,
-            "dateString": self.timestamp.isoformat(),
-            "sgv": round(self.glucose * 18),
-            "direction": self.direction or "NONE",
-            "device": self.device_type,
-        }
+        """Return sensor status as Nightscout entry, computed only once."""
+        if self._nightscout_entry is None:
+            self._nightscout_entry = _sgv_entry(
+                self.device_type, self.unix_timestamp, self.glucose, self.direction
+            )
+        return self._nightscout_entry
 
     @classmethod
     def from_easyview(cls, data: dict[str, Any]) -> SensorStatus:
@@ -108,75 +157,98 @@ class SensorStatus:
                 data["sequence"],
             )
             status = None
+        # positional in field order; noticeably faster than kwargs on back-fill
         return cls(
-            app_name=data["appName"],
-            battery_percent=data["batteryPercent"],
-            current=data["current"],
-            device_type=data["deviceType"],
-            glucose=data["glucose"],
-            glucose_rate=data["glucoseRate"],
-            sensor_id=data["sensorId"],
-            sequence=data["sequence"],
-            serial=data["serial"],
-            status=status,
-            update_time=data["updateTime"],
+            data["deviceType"],
+            data["glucose"],
+            data["glucoseRate"],
+            data["sensorId"],
+            data["sequence"],
+            data["serial"],
+            status,
+            data["updateTime"],
+            data["appName"],
+            data["batteryPercent"],
+            data["current"],
         )
 
     @classmethod
     def from_download(
         cls,
-        record: tuple[str, float, float, float, str, float],
+        record: Sequence[str | float],
         device_type,
     ) -> SensorStatus:
         """Create a SensorStatus from EasyView download record."""
-        pattern = r"^(?P<uid>\d+)-(?P<serial>\d+)-(?P<sensorId>\d+)-(?P<sequence>\d+)$"
-        match = re.match(pattern, record[0])
+        match = _RECORD_RE.fullmatch(record[0])
         if not match:
             raise ValueError("invalid EasyView download record")
-        status = {
-            "C": cls.Status.NORMAL,
-            "H": cls.Status.WARMING_UP,
-            "XC": cls.Status.NEEDS_CALIBRATION,
-        }
-        if record[4] not in status:
+        sensor_id = int(match.group(3))
+        sequence = int(match.group(4))
+        if record[4] not in _DOWNLOAD_STATUS:
             logger.warning(
                 "Unknown status '%s' in EasyView download record (sensor=%i, sequence=%i)",
                 record[4],
-                int(match.group("sensorId")),
-                int(match.group("sequence")),
+                sensor_id,
+                sequence,
             )
         return cls(
-            device_type=device_type,
-            glucose=record[3],
-            glucose_rate=round(record[5]),
-            sensor_id=int(match.group("sensorId")),
-            sequence=int(match.group("sequence")),
-            serial=int(match.group("serial")),
-            status=status.get(record[4]),
-            update_time=record[1],
+            device_type,
+            record[3],
+            round(record[5]),
+            sensor_id,
+            sequence,
+            int(match.group(2)),
+            _DOWNLOAD_STATUS.get(record[4]),
+            record[1],
         )
 
     @classmethod
     def from_timestamp(cls, timestamp: datetime, device_type: str) -> SensorStatus:
         """Create a SensorStatus with only timestamp set."""
-        return cls(
-            device_type=device_type,
-            glucose=0,
-            glucose_rate=0,
-            sensor_id=0,
-            sequence=0,
-            serial=0,
-            status=None,
-            update_time=datetime.timestamp(timestamp),
-        )
+        return cls(device_type, 0, 0, 0, 0, 0, None, datetime.timestamp(timestamp))
+
+
+# status letters in EasyView download records
+_DOWNLOAD_STATUS = {
+    "C": SensorStatus.Status.NORMAL,
+    "H": SensorStatus.Status.WARMING_UP,
+    "XC": SensorStatus.Status.NEEDS_CALIBRATION,
+}
+
+
+@functools.lru_cache(maxsize=4)
+def _api_secret_header(api_secret: str) -> str:
+    """Return the hashed api-secret header value Nightscout expects."""
+    return hashlib.sha1(api_secret.encode("utf-8")).hexdigest()
+
+
+def _pooled_adapter() -> requests.adapters.HTTPAdapter:
+    """Return an HTTPAdapter that keeps connections alive between requests.
+
+    Transient gateway errors on idempotent requests are retried inside
+    urllib3 before they surface as exceptions.
+    """
+    return requests.adapters.HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=8,
+        pool_block=True,
+        max_retries=requests.adapters.Retry(
+            total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504]
+        ),
+    )
 
 
 def with_retry(delay: int):
-    """Decorator to retry on session Timeout or ConnectionError."""
+    """Decorator to retry on session Timeout or ConnectionError.
+
+    Delays grow exponentially from the given value up to five minutes,
+    with jitter so restarted uploaders do not retry in lockstep.
+    """
 
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            attempt = 0
             while True:
                 try:
                     return func(*args, **kwargs)
@@ -184,7 +256,9 @@ def with_retry(delay: int):
                     logger.info("Network timeout, retrying")
                 except requests.exceptions.ConnectionError:
                     logger.info("Network connection error, retrying")
-                time.sleep(delay)
+                sleep_for = min(delay * 2**attempt, 300) * (0.5 + random.random())
+                attempt += 1
+                time.sleep(sleep_for)
 
         return wrapper
 
@@ -205,16 +279,22 @@ class EasyFollow:
         self.username = username
         self.password = password
         self.session: requests.Session = requests.Session()
+        adapter = _pooled_adapter()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.session.headers.update(
             {
                 "DevInfo": "Android 12;Xiamoi vayu;Android 12",
                 "AppTag": "v=1.2.70(112);n=eyfo;p=android",
                 "User-Agent": "okhttp/3.5.0",
+                "Connection": "keep-alive",
             }
         )
         self.resume_timestamp = timestamp
         self._queue: list[SensorStatus] = []
-        self._next_interval = datetime.now(timezone.utc)
+        self._next_monotonic = time.monotonic()
+        self._poll_delay = 5.0
+        self._wake = threading.Event()
 
     def __enter__(self):
         """Context manager entry, opens connection to EasyView."""
@@ -232,10 +312,14 @@ class EasyFollow:
         """Returns next SensorStatus from EasyView"""
         while not self._queue:
             cur_stat = self.sensor_status
-            delta = (self._next_interval - datetime.now(timezone.utc)).total_seconds()
+            delta = self._next_monotonic - time.monotonic()
             if delta > 0:
-                time.sleep(delta)
-            self._next_interval = datetime.now(timezone.utc) + timedelta(seconds=30)
+                self._wake.wait(delta)
+                self._wake.clear()
+            # re-poll quickly right after the expected sample time, then
+            # back off exponentially while the sample fails to appear
+            self._next_monotonic = time.monotonic() + self._poll_delay
+            self._poll_delay = min(self._poll_delay * 2, 60)
             raw_status = self.get_status()
             if raw_status.get("res") == "ERR":
                 logger.error("Easyview API returned: %s.", raw_status.get("msg"))
@@ -246,26 +330,31 @@ class EasyFollow:
             new_stat = SensorStatus.from_easyview(
                 raw_status["monitorlist"][0]["sensor_status"]
             )
-            if new_stat.key == cur_stat.key:
+            new_key = new_stat.key
+            cur_key = cur_stat.key
+            if new_key == cur_key:
                 logger.debug(
                     "no new data on EasyView (sensor=%i, sequence=%i)",
                     cur_stat.sensor_id,
                     cur_stat.sequence,
                 )
                 continue
-            if new_stat.preceding_key != cur_stat.key:
+            if new_stat.preceding_key != cur_key:
                 for s in self.history(cur_stat.timestamp, new_stat.timestamp):
-                    if new_stat.key > s.key > cur_stat.key:
+                    if new_key > s.key > cur_key:
                         self._queue.append(s)
             self._queue.append(new_stat)
-            self._next_interval = max(
-                new_stat.timestamp + timedelta(seconds=150), self._next_interval
+            # next sample is expected 150s after the current one
+            self._poll_delay = 5.0
+            self._next_monotonic = max(
+                time.monotonic() + new_stat.unix_timestamp + 150 - time.time(),
+                self._next_monotonic,
             )
 
         self.sensor_status = self._queue.pop(0)
         return self.sensor_status
 
-    @with_retry(delay=10)
+    @with_retry(delay=1)
     def _post(self, endpoint: str, data: dict) -> dict[str, Any]:
         """Send a POST request to the specified endpoint with the given data."""
         response = self.session.post(
@@ -274,7 +363,7 @@ class EasyFollow:
         response.raise_for_status()
         return response.json()
 
-    @with_retry(delay=10)
+    @with_retry(delay=1)
     def _get(self, endpoint: str, params: dict | None = None) -> dict[str, Any]:
         """Send a GET request to the specified endpoint with the given parameters."""
         response = self.session.get(
@@ -283,25 +372,29 @@ class EasyFollow:
         response.raise_for_status()
         return response.json()
 
+    @functools.cached_property
+    def _login_monitor(self) -> dict[str, Any]:
+        """Return the single monitored user from the EasyView login data."""
+        status = self.get_status()
+        if len(status["monitorlist"]) != 1:
+            logger.error(
+                "Follower should have exactly one CGM user, got %i",
+                len(status["monitorlist"]),
+            )
+            raise ValueError("Account should follow exactly one CGM user.")
+        return status["monitorlist"][0]
+
     @functools.cached_property
     def cgm_username(self) -> str:
         """Get the username of the user carrying the CGM."""
-        status = self.get_status()
-        return status["monitorlist"][0]["username"]
+        return self._login_monitor["username"]
 
     @property
     def sensor_status(self) -> SensorStatus:
         """Return the last retrieved sensor status."""
         if self._sensor_status is None:
-            status = self.get_status()
-            if len(status["monitorlist"]) != 1:
-                logger.error(
-                    "Follower should have exactly one CGM user, got %i",
-                    len(status["monitorlist"]),
-                )
-                raise ValueError("Account should follow exactly one CGM user.")
             self._sensor_status = SensorStatus.from_easyview(
-                status["monitorlist"][0]["sensor_status"]
+                self._login_monitor["sensor_status"]
             )
             if self.resume_timestamp is None:
                 self._sensor_status = SensorStatus.from_timestamp(
@@ -338,6 +431,15 @@ class EasyFollow:
             self.sensor_status.sequence,
         )
 
+    @property
+    def pending(self) -> bool:
+        """Return True if entries are queued for immediate retrieval."""
+        return bool(self._queue)
+
+    def wake(self) -> None:
+        """Interrupt the idle wait so the next poll fires immediately."""
+        self._wake.set()
+
     def open(self) -> None:
         """Establish a connection to EasyView."""
         data = {
@@ -361,10 +463,11 @@ class EasyFollow:
 
     def get_downloads(self, start: datetime, end: datetime) -> dict[str, Any]:
         """Get historical sensor status data from EasyView API."""
+        fmt = "%Y-%m-%d %H:%M:%S"
         params = {
             "flag": "sg",
-            "st": (start + timedelta(seconds=30)).strftime("%Y-%m-%d %H:%M:%S"),
-            "et": (end - timedelta(seconds=30)).strftime("%Y-%m-%d %H:%M:%S"),
+            "st": time.strftime(fmt, time.gmtime(start.timestamp() + 30)),
+            "et": time.strftime(fmt, time.gmtime(end.timestamp() - 30)),
             "user_name": self.cgm_username,
         }
         return self._get("download", params)
@@ -373,23 +476,61 @@ class EasyFollow:
         """Returns iterator of SensorStatus objects for requested period."""
         downloads = self.get_downloads(start, end)["data"]
         device_type = self.sensor_status.device_type
-        for rec in map(tuple, downloads):
+        for rec in downloads:
             try:
                 yield SensorStatus.from_download(rec, device_type=device_type)
             except ValueError:
                 pass
 
+    def iter_history_entries(
+        self, start: datetime, end: datetime
+    ) -> Iterator[dict[str, str | int]]:
+        """Yield Nightscout entries for the requested period in a single pass.
+
+        Bulk back-fill does not need the SensorStatus bookkeeping, so the
+        dataclass and Status lookup are skipped entirely; warming-up
+        records carry no glucose value and are dropped.
+        """
+        device_type = self.sensor_status.device_type
+        for rec in self.get_downloads(start, end)["data"]:
+            if rec[4] == "H" or not _RECORD_RE.fullmatch(rec[0]):
+                continue
+            rate = round(rec[5])
+            direction = _DIRECTIONS[rate] if 0 <= rate < len(_DIRECTIONS) else None
+            yield _sgv_entry(device_type, round(rec[1]), rec[3], direction)
+
+    def backfill(self) -> Iterator[dict[str, str | int]]:
+        """Yield Nightscout entries between the resume point and live status.
+
+        Catches up in bulk after a restart: the gap is emitted as plain
+        entry dicts and the live status becomes the new stream position,
+        so iteration afterwards continues from there.
+        """
+        live = SensorStatus.from_easyview(self._login_monitor["sensor_status"])
+        if live.key == self.sensor_status.key:
+            return
+        yield from self.iter_history_entries(
+            self.sensor_status.timestamp, live.timestamp
+        )
+        if live.status is not SensorStatus.Status.WARMING_UP:
+            yield live.nightscout_entry
+        self.sensor_status = live
+
 
 class NightScout:
     """Class that interacts with Nightscout to sync CGM data."""
 
     def __init__(self, url, api_secret):
         self.session = requests.Session()
+        adapter = _pooled_adapter()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.session.headers.update(
             {
                 "Content-Type": "application/json",
                 "Accept": "application/json",
-                "api-secret": hashlib.sha1(api_secret.encode("utf-8")).hexdigest(),
+                "api-secret": _api_secret_header(api_secret),
+                "Connection": "keep-alive",
             }
         )
         self.url = url
@@ -400,47 +541,68 @@ class NightScout:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.session.close()
 
-    @property
+    @functools.cached_property
     def timestamp(self) -> datetime | None:
         """Get last sensor value timestamp from Nightscout."""
+        data = self._get_last_entries()
+        if data:
+            return datetime.fromtimestamp(data[0]["date"] // 1000, tz=timezone.utc)
+        return None
+
+    @with_retry(delay=1)
+    def _get_last_entries(self) -> list[dict[str, Any]]:
+        """Fetch the most recent entry from Nightscout."""
         response = self.session.get(
             f"{self.url}/api/v1/entries.json", params={"count": 1}, timeout=10
         )
         response.raise_for_status()
-        data = response.json()
-        if data:
-            return datetime.fromtimestamp(data[0]["date"] / 1000, tz=timezone.utc)
-        return None
+        return response.json()
 
-    @with_retry(delay=10)
     def add(self, sensor_status: SensorStatus) -> None:
-        """Add a sensor value to Nightscout."""
-        if sensor_status.Status is SensorStatus.Status.WARMING_UP:
-            logger.info(
-                "sensor is warming up (sensor=%i, sequence=%i)",
-                sensor_status.sensor_id,
-                sensor_status.sequence,
-            )
-        else:
-            response = self.session.post(
-                f"{self.url}/api/v1/entries.json",
-                json=[sensor_status.nightscout_entry],
-                timeout=10,
-            )
-            response.raise_for_status()
-            logger.info(
-                "submitted sensor status to nightscout (sensor=%i, sequence=%i)",
-                sensor_status.sensor_id,
-                sensor_status.sequence,
-            )
+        """Add a single sensor value to Nightscout."""
+        self.add_many([sensor_status])
+
+    @with_retry(delay=1)
+    def add_many(self, entries: list[SensorStatus | dict[str, str | int]]) -> None:
+        """Add a batch of sensor values or entry dicts in a single request."""
+        payload = []
+        for entry in entries:
+            if isinstance(entry, dict):
+                payload.append(entry)
+            elif entry.status is SensorStatus.Status.WARMING_UP:
+                logger.info(
+                    "sensor is warming up (sensor=%i, sequence=%i)",
+                    entry.sensor_id,
+                    entry.sequence,
+                )
+            else:
+                payload.append(entry.nightscout_entry)
+        if not payload:
+            return
+        response = self.session.post(
+            f"{self.url}/api/v1/entries.json",
+            data=_json_dumps(payload),
+            timeout=10,
+        )
+        response.raise_for_status()
+        logger.info("submitted %i sensor statuses to nightscout", len(payload))
+
+
+def _produce(ef: EasyFollow, entries: queue.Queue) -> None:
+    """Stream sensor statuses into the queue; forward errors as items."""
+    try:
+        for sensor_status in ef:
+            entries.put(sensor_status)
+    except BaseException as exc:
+        entries.put(exc)
 
 
 def main():
     """Main function to sync CGM data from EasyView to Nightscout."""
 
-    secrets_file = pathlib.Path.home() / ".nightscout_easyview/secrets.yaml"
-    with secrets_file.open(encoding="utf-8") as f:
-        secrets = yaml.safe_load(f)
+    secrets_file = pathlib.Path.home() / ".nightscout_easyview/secrets.toml"
+    with secrets_file.open("rb") as f:
+        secrets = tomllib.load(f)
     username = secrets["easyview"]["username"]
     password = secrets["easyview"]["password"]
     ns_url = secrets["nightscout"]["url"]
@@ -448,8 +610,40 @@ def main():
 
     with NightScout(ns_url, api_secret) as ns:
         with EasyFollow(username, password, ns.timestamp) as ef:
-            for sensor_status in ef:
-                ns.add(sensor_status)
+            backlog = list(ef.backfill())
+            if backlog:
+                ns.add_many(backlog)
+            entries: queue.Queue = queue.Queue(maxsize=32)
+            producer = threading.Thread(
+                target=_produce, args=(ef, entries), daemon=True
+            )
+            producer.start()
+            batch: list[SensorStatus] = []
+            # keys already sent to Nightscout, bounded to the last 1024
+            seen: collections.OrderedDict[tuple[int, int], None]
+            seen = collections.OrderedDict()
+            while True:
+                item = entries.get()
+                while True:
+                    if isinstance(item, BaseException):
+                        raise item
+                    if item.key in seen:
+                        logger.debug(
+                            "skipping duplicate entry (sensor=%i, sequence=%i)",
+                            item.sensor_id,
+                            item.sequence,
+                        )
+                    else:
+                        seen[item.key] = None
+                        if len(seen) > 1024:
+                            seen.popitem(last=False)
+                        batch.append(item)
+                    if entries.empty() or len(batch) >= 100:
+                        break
+                    item = entries.get_nowait()
+                if batch:
+                    ns.add_many(batch)
+                    batch.clear()
 
 
 if __name__ == "__main__":